@@ -1,7 +1,15 @@
 import streamlit as st
 import math
 import ast
+import copy
+import functools
 import operator as op
+import re
+
+try:
+    from numba import njit as _njit
+except ImportError:  # numba is optional; the plain compiled path still runs
+    _njit = None
 
 # ---------- Safe evaluator ----------
 ALLOWED_OPERATORS = {
@@ -16,6 +24,22 @@ ALLOWED_OPERATORS = {
     ast.FloorDiv: op.floordiv,
 }
 
+# math.factorial is O(n) arbitrary-precision multiplies; the UI re-evaluates
+# the same small inputs on every rerun, so memoize results.
+_fact_cache: dict = {}
+
+def _myfact(n):
+    if type(n) is not int:
+        # Floats hash equal to their int values, so a cached 5! entry would
+        # answer 5.0! even though math.factorial rejects floats; keep non-int
+        # arguments on the uncached path so they fail the same way every time.
+        return math.factorial(n)
+    r = _fact_cache.get(n)
+    if r is None:
+        r = math.factorial(n)
+        _fact_cache[n] = r
+    return r
+
 MATH_FUNCS = {
     'sin': math.sin,
     'cos': math.cos,
@@ -28,87 +52,469 @@ MATH_FUNCS = {
     'ln': math.log,
     'log10': math.log10,
     'abs': abs,
-    'fact': math.factorial,
-    'factorial': math.factorial,
+    'fact': _myfact,
+    'factorial': _myfact,
     'pi': math.pi,
     'e': math.e,
     'pow': pow,
 }
 
-class EvalVisitor(ast.NodeVisitor):
-    def visit(self, node):
-        if isinstance(node, ast.Expression):
-            return self.visit(node.body)
-        elif isinstance(node, ast.BinOp):
-            left = self.visit(node.left)
-            right = self.visit(node.right)
-            op_type = type(node.op)
-            if op_type in ALLOWED_OPERATORS:
-                return ALLOWED_OPERATORS[op_type](left, right)
-            raise ValueError(f"Operator {op_type} not allowed")
-        elif isinstance(node, ast.UnaryOp):
-            operand = self.visit(node.operand)
-            op_type = type(node.op)
-            if op_type in ALLOWED_OPERATORS:
-                return ALLOWED_OPERATORS[op_type](operand)
-            raise ValueError(f"Unary operator {op_type} not allowed")
-        elif isinstance(node, ast.Num):
-            return node.n
-        elif hasattr(ast, 'Constant') and isinstance(node, ast.Constant):
-            return node.value
-        elif isinstance(node, ast.Call):
+def _flatten(tree, funcs=MATH_FUNCS):
+    # Flatten an AST into a postorder (fn, nargs) program — RPN. nargs None
+    # marks a plain value push. Flattening and evaluation are both iterative,
+    # so deep chains like 1+1+... neither pay per-node frame setup nor hit
+    # the recursion limit.
+    prog = []
+    stack = [(tree, False)]
+    while stack:
+        node, emit = stack.pop()
+        if emit:
+            if isinstance(node, ast.Call):
+                prog.append((funcs[node.func.id], len(node.args)))
+            else:
+                prog.append((node._fn, 2 if isinstance(node, ast.BinOp) else 1))
+            continue
+        t = type(node)
+        if t is ast.Expression:
+            stack.append((node.body, False))
+        elif t is ast.Expr:
+            stack.append((node.value, False))
+        elif t is ast.BinOp or t is ast.UnaryOp:
+            if not hasattr(node, '_fn'):  # trees from _parse_cached are pre-bound
+                op_type = type(node.op)
+                if op_type not in ALLOWED_OPERATORS:
+                    raise ValueError(f"Operator {op_type} not allowed")
+                node._fn = ALLOWED_OPERATORS[op_type]
+            stack.append((node, True))
+            if t is ast.BinOp:
+                stack.append((node.right, False))
+                stack.append((node.left, False))
+            else:
+                stack.append((node.operand, False))
+        elif t is ast.Constant:
+            prog.append((node.value, None))
+        elif t is ast.Call:
             func = node.func
-            if isinstance(func, ast.Name):
-                name = func.id
-                if name in MATH_FUNCS:
-                    args = [self.visit(a) for a in node.args]
-                    return MATH_FUNCS[name](*args)
-            raise ValueError("Function calls are restricted")
-        elif isinstance(node, ast.Name):
-            if node.id in MATH_FUNCS:
-                return MATH_FUNCS[node.id]
-            raise ValueError(f"Name {node.id} is not allowed")
-        elif isinstance(node, ast.Expr):
-            return self.visit(node.value)
+            if not (isinstance(func, ast.Name) and func.id in funcs):
+                raise ValueError("Function calls are restricted")
+            stack.append((node, True))
+            for a in reversed(node.args):
+                stack.append((a, False))
+        elif t is ast.Name:
+            if node.id not in funcs:
+                raise ValueError(f"Name {node.id} is not allowed")
+            prog.append((funcs[node.id], None))
         else:
-            raise ValueError(f"Expression element {type(node)} not allowed")
+            raise ValueError(f"Expression element {t} not allowed")
+    return prog
 
-def safe_eval(expr: str):
-    expr = expr.replace('^', '**')
-    i = 0
-    out = ''
-    while i < len(expr):
-        ch = expr[i]
-        if ch == '!':
+def _run_program(prog):
+    stack = []
+    push = stack.append
+    for fn, n in prog:
+        if n is None:
+            push(fn)
+        elif n == 2:
+            right = stack.pop()
+            stack[-1] = fn(stack[-1], right)
+        elif n == 1:
+            stack[-1] = fn(stack[-1])
+        elif n:
+            args = stack[-n:]
+            del stack[-n:]
+            push(fn(*args))
+        else:
+            push(fn())
+    return stack.pop()
+
+class EvalVisitor(ast.NodeVisitor):
+    # Pure-Python reference evaluator; safe_eval itself uses the compiled
+    # path. Kept as a thin wrapper over the iterative flatten/run pair.
+    def __init__(self):
+        self._funcs = MATH_FUNCS
+
+    def visit(self, node):
+        return _run_program(_flatten(node, self._funcs))
+
+def _bind_operators(tree):
+    # The tree is immutable per parse, so resolve each operator to its
+    # function once here; disallowed operators fail at annotation time and
+    # evaluation becomes a plain attribute load + call.
+    for n in ast.walk(tree):
+        if isinstance(n, (ast.BinOp, ast.UnaryOp)):
+            op_type = type(n.op)
+            if op_type not in ALLOWED_OPERATORS:
+                raise ValueError(f"Operator {op_type} not allowed")
+            n._fn = ALLOWED_OPERATORS[op_type]
+    return tree
+
+@functools.lru_cache(maxsize=256)
+def _parse_cached(expr: str):
+    # Streamlit reruns the script on every widget interaction, so the same
+    # expression string gets parsed over and over; cache the compiled AST.
+    return _bind_operators(ast.parse(expr, mode='eval'))
+
+# Matches a number, a name, or a paren group with no nested parens, followed
+# by '!'. Applied repeatedly so inner factorials are rewritten first.
+_FACT_RE = re.compile(r'(\d+\.?\d*|[A-Za-z_]\w*|\([^()]*\))!')
+
+def _rewrite_factorials_scan(expr: str):
+    # Character-scan fallback for paren groups the regex can't reach (a ')!'
+    # whose group itself contains parens, e.g. after an inner rewrite). The
+    # output is built as a list, and a stack of open-paren positions is kept
+    # while copying so each ')!' finds its matching '(' in O(1) instead of
+    # rescanning the output backwards per '!'.
+    out = []
+    opens = []
+    last_open = -1  # position of '(' matching the most recently closed group
+    for ch in expr:
+        if ch == '(':
+            opens.append(len(out))
+            out.append(ch)
+        elif ch == ')':
+            out.append(ch)
+            last_open = opens.pop() if opens else -1
+        elif ch == '!':
             j = len(out) - 1
             if j >= 0 and out[j] == ')':
-                depth = 0
-                k = j
-                while k >= 0:
-                    if out[k] == ')':
-                        depth += 1
-                    elif out[k] == '(':
-                        depth -= 1
-                        if depth == 0:
-                            break
-                    k -= 1
-                token = out[k: j + 1]
-                out = out[:k] + f'factorial{token}'
+                k = last_open if last_open >= 0 else 0
+                out[k:k] = 'factorial'
+                last_open = k + 9  # the group's '(' shifted by len('factorial')
             else:
                 k = j
                 while k >= 0 and (out[k].isalnum() or out[k] == '.' or out[k] == '_'):
                     k -= 1
-                token = out[k+1: j+1]
-                out = out[:k+1] + f'factorial({token})'
-            i += 1
+                out[k + 1:k + 1] = 'factorial('
+                out.append(')')
+                last_open = k + 10
+        else:
+            out.append(ch)
+    return ''.join(out)
+
+@functools.lru_cache(maxsize=256)
+def _preprocess_cached(expr: str):
+    expr = expr.replace('^', '**')
+    while '!' in expr:
+        expr, n = _FACT_RE.subn(r'factorial(\1)', expr)
+        if n == 0:
+            expr = _rewrite_factorials_scan(expr)
+            break
+    return expr
+
+def _validate(node):
+    # One pass over the tree, checks only; no value computation. Anything not
+    # explicitly whitelisted is rejected.
+    for n in ast.walk(node):
+        if isinstance(n, (ast.Expression, ast.Load, ast.operator, ast.unaryop)):
             continue
+        elif isinstance(n, (ast.BinOp, ast.UnaryOp)):
+            if type(n.op) not in ALLOWED_OPERATORS:
+                raise ValueError(f"Operator {type(n.op)} not allowed")
+        elif isinstance(n, ast.Constant):
+            if not isinstance(n.value, (int, float)):
+                raise ValueError(f"Constant {n.value!r} not allowed")
+        elif isinstance(n, ast.Call):
+            if not (isinstance(n.func, ast.Name) and n.func.id in MATH_FUNCS):
+                raise ValueError("Function calls are restricted")
+        elif isinstance(n, ast.Name):
+            if n.id not in MATH_FUNCS:
+                raise ValueError(f"Name {n.id} is not allowed")
         else:
-            out += ch
-        i += 1
-    expr = out
+            raise ValueError(f"Expression element {type(n)} not allowed")
+
+_TRIG_FUNCS = {'sin', 'cos', 'tan'}
+_INV_TRIG_FUNCS = {'asin', 'acos', 'atan'}
+_ANGLE_FUNCS = _TRIG_FUNCS | _INV_TRIG_FUNCS
+
+def _has_angle_call(tree):
+    # Iterative precheck so trees without trig calls never enter the
+    # recursive deepcopy/transformer below.
+    for n in ast.walk(tree):
+        if (isinstance(n, ast.Call) and isinstance(n.func, ast.Name)
+                and n.func.id in _ANGLE_FUNCS):
+            return True
+    return False
+
+class _AngleTransformer(ast.NodeTransformer):
+    # DEG mode rewrite: sin(x) -> sin(x * pi/180) and asin(x) -> asin(x) *
+    # 180/pi. Runs once per cached parse, so evaluation only sees a constant
+    # multiply instead of a per-call radians()/degrees() wrapper.
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        if isinstance(node.func, ast.Name) and len(node.args) == 1:
+            name = node.func.id
+            if name in _TRIG_FUNCS:
+                node.args[0] = ast.BinOp(left=node.args[0], op=ast.Mult(),
+                                         right=ast.Constant(math.pi / 180.0))
+            elif name in _INV_TRIG_FUNCS:
+                return ast.BinOp(left=node, op=ast.Mult(),
+                                 right=ast.Constant(180.0 / math.pi))
+        return node
+
+class _ConstantFolder(ast.NodeTransformer):
+    # 'pi' and 'e' resolve to the same float on every evaluation; rewriting
+    # them to literal constants lets compile()'s peephole pass fold things
+    # like 2*pi down to a single constant.
+    def visit_Name(self, node):
+        if node.id in ('pi', 'e'):
+            return ast.copy_location(ast.Constant(value=MATH_FUNCS[node.id]), node)
+        return node
+
+def _has_constant_name(tree):
+    # Iterative precheck so plain-arithmetic trees never enter the recursive
+    # transformer; deep operator chains must not recurse per tree level.
+    for n in ast.walk(tree):
+        if isinstance(n, ast.Name) and n.id in ('pi', 'e'):
+            return True
+    return False
+
+@functools.lru_cache(maxsize=256)
+def _transformed_cached(expr: str, angle_mode: str):
+    tree = _parse_cached(expr)
+    if angle_mode == 'DEG' and _has_angle_call(tree):
+        # _parse_cached shares trees across callers, so rewrite a copy.
+        # deepcopy and the transformer both recurse, but trig expressions
+        # deep enough to matter are unreachable from the keypad; trees
+        # without trig calls skip this entirely.
+        tree = _AngleTransformer().visit(copy.deepcopy(tree))
+        _bind_operators(tree)  # the injected BinOps need _fn too
+    if _has_constant_name(tree):
+        tree = _ConstantFolder().visit(tree)
+    ast.fix_missing_locations(tree)
+    return tree
+
+# Subset of MATH_FUNCS that is pure float math — the functions numba's
+# nopython mode understands. Maps straight to the underlying callables so the
+# generated closure doesn't go through wrapper lambdas.
+NUMERIC_FUNCS = {
+    'sin': math.sin,
+    'cos': math.cos,
+    'tan': math.tan,
+    'asin': math.asin,
+    'acos': math.acos,
+    'atan': math.atan,
+    'sqrt': math.sqrt,
+    'log': math.log10,
+    'ln': math.log,
+    'log10': math.log10,
+    'abs': abs,
+    'pi': math.pi,
+    'e': math.e,
+}
+
+def _is_numeric_only(tree):
+    for n in ast.walk(tree):
+        if isinstance(n, (ast.Expression, ast.Load, ast.operator, ast.unaryop,
+                          ast.BinOp, ast.UnaryOp)):
+            continue
+        elif isinstance(n, ast.Constant):
+            if not isinstance(n.value, (int, float)):
+                return False
+        elif isinstance(n, ast.Call):
+            if not (isinstance(n.func, ast.Name) and n.func.id in NUMERIC_FUNCS):
+                return False
+        elif isinstance(n, ast.Name):
+            if n.id not in NUMERIC_FUNCS:
+                return False
+        else:
+            return False
+    return True
+
+@functools.lru_cache(maxsize=256)
+def _numeric_closure_cached(expr: str, angle_mode: str = 'RAD'):
+    # Codegen a zero-arg closure for expressions that are pure float math
+    # (the common calculator case); returns None when the expression needs
+    # the general path. With numba installed the closure is JIT-compiled.
+    tree = _transformed_cached(expr, angle_mode)
+    if not _is_numeric_only(tree):
+        return None
+    if angle_mode == 'RAD':
+        src = expr  # untransformed, so the preprocessed string is the source
+    else:
+        try:
+            src = ast.unparse(tree)
+        except RecursionError:  # unparse recurses; very deep trees fall back
+            return None
+    ns = {'__builtins__': {}}
+    ns.update(NUMERIC_FUNCS)
+    fn = eval(compile(f'lambda: ({src})', '<calc-codegen>', 'eval'), ns)
+    if _njit is not None:
+        try:
+            jitted = _njit(fn)
+            jitted()  # compile eagerly; fall back if numba rejects the body
+            fn = jitted
+        except Exception:
+            pass
+    return fn
+
+@functools.lru_cache(maxsize=256)
+def _compile_cached(expr: str, angle_mode: str = 'RAD'):
+    tree = _transformed_cached(expr, angle_mode)
+    _validate(tree)
+    return compile(tree, '<calc>', 'eval')
+
+# 'digits op digits' — the most common shape mid-keypress.
+_SIMPLE_BINOP_RE = re.compile(r'^(\d+)([+\-*/])(\d+)$')
+_SIMPLE_OPS = {'+': op.add, '-': op.sub, '*': op.mul, '/': op.truediv}
+
+@functools.lru_cache(maxsize=512)
+def safe_eval(expr: str, angle_mode: str = 'RAD'):
+    # Pure in its arguments, so the whole result is memoized: unrelated
+    # reruns (memory keys, mode toggles, history) return instantly. The UI's
+    # AC handler should call safe_eval.cache_clear() to bound memory.
+    # angle_mode is part of the key so DEG and RAD results stay separate.
+    # Fast paths: mid-keypress strings like '7', '7.5' or '7+8' need no AST
+    # machinery at all.
+    try:
+        return int(expr)
+    except ValueError:
+        try:
+            return float(expr)
+        except ValueError:
+            pass
+    m = _SIMPLE_BINOP_RE.match(expr)
+    if m:
+        return _SIMPLE_OPS[m[2]](int(m[1]), int(m[3]))
+    expr = _preprocess_cached(expr)
+    # After preprocessing many inputs reduce to a bare constant name or a
+    # single literal; neither needs compiling.
+    const = MATH_FUNCS.get(expr)
+    if isinstance(const, float):  # 'pi' / 'e'
+        return const
+    try:
+        lit = ast.literal_eval(expr)
+    except (ValueError, SyntaxError):
+        pass
+    else:
+        if isinstance(lit, (int, float)):
+            return lit
+    fn = _numeric_closure_cached(expr, angle_mode)
+    if fn is not None:
+        return fn()
+    code = _compile_cached(expr, angle_mode)
+    # Validated above, so running the code object under the C eval loop with
+    # empty builtins and the whitelist as globals is safe.
+    return eval(code, {'__builtins__': {}}, MATH_FUNCS)
+
+# ---------- Streamlit UI ----------
+
+st.set_page_config(page_title='Casio fx-991 — Streamlit', layout='centered')
+
+st.markdown("""
+<style>
+.calculator-container {background:#2f3640; padding: 12px; border-radius:12px; max-width:420px; margin:auto}
+.display {background:#ffffff; color:#000; padding:10px; border-radius:8px; font-size:24px; min-height:48px}
+</style>
+""", unsafe_allow_html=True)
+
+# The expression is kept as a list of tokens; appending/popping is O(1),
+# whereas growing a session-state string reallocates it on every press.
+if 'tokens' not in st.session_state:
+    st.session_state.tokens = []
+if 'history' not in st.session_state:
+    st.session_state.history = []
+if 'memory' not in st.session_state:
+    st.session_state.memory = 0.0
+if 'angle' not in st.session_state:
+    st.session_state.angle = 'DEG'  # or 'RAD'
+# Evaluation only happens on '='; result holds the last computed value and
+# dirty marks whether the expression changed since, so reruns triggered by
+# every other button never call safe_eval.
+if 'result' not in st.session_state:
+    st.session_state.result = None
+if 'dirty' not in st.session_state:
+    st.session_state.dirty = True
+
+def _expr():
+    # Join only where the string is actually needed (display and eval).
+    return ''.join(st.session_state.tokens)
+
+def _press(label):
+    st.session_state.tokens.append(label)
+    st.session_state.dirty = True
+
+def _backspace():
+    if st.session_state.tokens:
+        st.session_state.tokens.pop()
+    st.session_state.dirty = True
+
+def _clear():
+    st.session_state.tokens.clear()
+    st.session_state.dirty = True
+
+def _all_clear():
+    st.session_state.tokens.clear()
+    st.session_state.history.clear()
+    st.session_state.memory = 0.0
+    st.session_state.result = None
+    st.session_state.dirty = True
+    safe_eval.cache_clear()
+
+def _toggle_angle():
+    st.session_state.angle = 'RAD' if st.session_state.angle == 'DEG' else 'DEG'
+    st.session_state.dirty = True  # DEG/RAD changes what the result would be
+
+def _equals():
+    expr = _expr()
+    if not expr:
+        return
+    try:
+        result = safe_eval(expr, st.session_state.angle)
+    except Exception:
+        result = 'Error'
+    else:
+        st.session_state.history.append(f'{expr} = {result}')
+        st.session_state.tokens = [str(result)]
+    st.session_state.result = result
+    st.session_state.dirty = False
+
+def _mem_clear():
+    st.session_state.memory = 0.0
+
+def _mem_recall():
+    st.session_state.tokens.append(repr(st.session_state.memory))
+
+def _mem_add(sign):
+    try:
+        st.session_state.memory += sign * float(safe_eval(_expr(), st.session_state.angle))
+    except Exception:
+        pass
+
+st.markdown(f"<div style='display:flex; justify-content:space-between; align-items:center; padding:6px;'>"
+            f"<div style='font-weight:700'>fx-991 · Streamlit</div>"
+            f"<div style='font-size:12px'>Mode: {st.session_state.angle}</div>"
+            f"</div>", unsafe_allow_html=True)
+
+_shown = _expr() or '0' if st.session_state.dirty else st.session_state.result
+st.markdown(f"<div class=\"display\">{_shown}</div>", unsafe_allow_html=True)
+
+for c, (label, handler, args) in zip(st.columns(5), [
+        ('AC', _all_clear, ()),
+        ('C', _clear, ()),
+        ('⌫', _backspace, ()),
+        (st.session_state.angle, _toggle_angle, ()),
+        ('=', _equals, ())]):
+    c.button(label, key=f'ctl_{label}', on_click=handler, args=args)
+
+for c, (label, handler, args) in zip(st.columns(5), [
+        ('MC', _mem_clear, ()),
+        ('MR', _mem_recall, ()),
+        ('M+', _mem_add, (1,)),
+        ('M-', _mem_add, (-1,)),
+        ('%', _press, ('%',))]):
+    c.button(label, key=f'mem_{label}', on_click=handler, args=args)
 
-    node = ast.parse(expr, mode='eval')
-    visitor = EvalVisitor()
-    return visitor.visit(node)
+_KEYPAD = [
+    ('sin(', 'cos(', 'tan(', 'sqrt(', '^'),
+    ('asin(', 'acos(', 'atan(', 'log(', 'ln('),
+    ('7', '8', '9', '(', ')'),
+    ('4', '5', '6', '*', '/'),
+    ('1', '2', '3', '+', '-'),
+    ('0', '.', 'pi', 'e', '!'),
+]
+for row in _KEYPAD:
+    for c, label in zip(st.columns(len(row)), row):
+        c.button(label, key=f'btn_{label}', on_click=_press, args=(label,))
 
-# ---------- Streamlit UI ---
+for line in reversed(st.session_state.history[-5:]):
+    st.caption(line)